@@ -18,17 +18,35 @@ This module includes 1 class, GitRepository, representing a repository in Git.
 
 import logging
 import os
+import re
+import subprocess
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 from pathlib import Path
 from threading import Lock
-from typing import List, Dict, Tuple, Set, Generator
+from typing import List, Dict, Tuple, Set, FrozenSet, Generator
 
 from git import Git, Repo, GitCommandError, Commit as GitCommit
+from gitdb.util import hex_to_bin
 
 from pydriller.domain.commit import Commit, ModificationType, Modification
 from pydriller.utils.hyperblame import GitHyperBlame
 
 logger = logging.getLogger(__name__)
 
+HASH_CACHE_SIZE = 4096
+MAX_BLAME_WORKERS = 8
+
+# "-"/"+" lines, hunk headers and "\ No newline at end of file" markers
+_DIFF_LINE_RE = re.compile(r'^([-+@\\]?)(.*)$', re.M)
+_HUNK_HEADER_RE = re.compile(r'^@@ -(\d+)(?:,\d+)? \+(\d+)(?:,\d+)? @@')
+# what can be safely written on a line of "git cat-file --batch"
+_BATCH_REF_RE = re.compile(r'[^\s\x00-\x1f\x7f]+\Z')
+_HEX_RE = re.compile(r'[0-9a-f]{4,40}\Z')
+# comments in Java and Python
+_USELESS_PREFIXES = ('//', '#', '/*', "'''", '"""', '*')
+
 
 class GitRepository:
     """
@@ -44,12 +62,20 @@ class GitRepository:
         :param str path: path to the repository
         """
         self.path = Path(path)
+        self._path_str = str(self.path)
         self.hyperblame = GitHyperBlame(path)
         self.project_name = self.path.name
         self.lock = Lock()
         self._hyper_blame_available = None
         self._git = None
         self._repo = None
+        self._cat_file_proc = None
+        self._on_pd_branch = None
+        self._hash_cache = OrderedDict()
+        self._hash_cache_lock = Lock()
+        self._tag_cache = {}
+        self._tagged_commits = None
+        self._hashes_to_ignore_cache = {}
         self._commit_options = {
             "path": self.path,
             "main_branch": None
@@ -81,10 +107,10 @@ class GitRepository:
         return self._repo
 
     def _open_git(self):
-        self._git = Git(str(self.path))
+        self._git = Git(self._path_str)
 
     def _open_repository(self):
-        self._repo = Repo(str(self.path))
+        self._repo = Repo(self._path_str)
         if self._commit_options["main_branch"] is None:
             self._discover_main_branch(self._repo)
 
@@ -96,6 +122,101 @@ class GitRepository:
                         "main branch to empty string")
             self._commit_options["main_branch"] = ''
 
+    def _cat_file(self, ref: str) -> Tuple[str, str, bytes]:
+        """
+        Read an object through a persistent "git cat-file --batch" process,
+        so that we spawn git only once per repository instead of once per
+        lookup. ValueError is raised if the object can not be read this way
+        (e.g. it does not exist): the caller should then fall back to
+        GitPython.
+
+        :param str ref: hash (or any revision) of the object to read
+        :return: Tuple (hash, type, raw content) of the object
+        """
+        if not _BATCH_REF_RE.match(ref):
+            # whitespace would split the ref in more requests, and every
+            # later reply would belong to the previous request
+            raise ValueError('Ref {!r} can not be sent to cat-file'
+                             .format(ref))
+
+        with self.lock:
+            if self._cat_file_proc is None:
+                self._cat_file_proc = subprocess.Popen(
+                    ['git', '-C', self._path_str, 'cat-file', '--batch'],
+                    stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            proc = self._cat_file_proc
+            try:
+                proc.stdin.write(ref.encode('utf-8') + b'\n')
+                proc.stdin.flush()
+
+                header = proc.stdout.readline().decode('utf-8').split()
+                if header[-1:] in (['missing'], ['ambiguous']):
+                    raise LookupError
+                sha, obj_type, size = header
+                # the content is always followed by a newline
+                data = proc.stdout.read(int(size) + 1)
+                if len(data) != int(size) + 1 or data[-1:] != b'\n':
+                    raise ValueError('truncated reply')
+            except LookupError:
+                raise ValueError('Object {} not found'.format(ref)) \
+                    from None
+            except (OSError, ValueError) as e:
+                # a dead process or a partial read: the next replies could
+                # belong to other requests, so never reuse this process
+                self._kill_cat_file()
+                raise ValueError('Can not read {} with cat-file: {}'
+                                 .format(ref, e)) from e
+
+        name, _, peel = ref.lower().partition('^')
+        if _HEX_RE.match(name) and peel in ('', '{commit}') \
+                and not sha.startswith(name):
+            # e.g. an annotated tag peeled to its commit
+            raise ValueError('cat-file returned {} for {}'.format(sha, ref))
+        return sha, obj_type, data[:-1]
+
+    def _kill_cat_file(self) -> None:
+        proc = self._cat_file_proc
+        self._cat_file_proc = None
+        proc.kill()
+        for pipe in (proc.stdin, proc.stdout):
+            try:
+                pipe.close()
+            except OSError:
+                # e.g. BrokenPipeError while flushing stdin
+                pass
+        proc.wait()
+
+    def close(self) -> None:
+        """
+        Terminate the git processes used by this GitRepository (they are
+        started again if it is used afterwards).
+        """
+        self._close_processes()
+        if self._repo is not None:
+            self._repo.close()
+        if self._git is not None:
+            self._git.clear_cache()
+
+    def _close_processes(self) -> None:
+        proc = self._cat_file_proc
+        if proc is not None:
+            self._cat_file_proc = None
+            proc.stdin.close()
+            proc.stdout.close()
+            proc.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __del__(self):
+        try:
+            self._close_processes()
+        except (OSError, AttributeError):
+            pass
+
     def get_head(self) -> Commit:
         """
         Get the head commit.
@@ -106,15 +227,25 @@ class GitRepository:
         return Commit(head_commit, **self._commit_options)
 
     def get_list_commits(self, branch: str = None,
-                         reverse_order: bool = True) \
+                         reverse_order: bool = True, **kwargs) \
             -> Generator[Commit, None, None]:
         """
         Return a generator of commits of all the commits in the repo.
 
+        Additional keyword arguments are passed to "git rev-list" (e.g.
+        until, author, no_merges), so that the commits it filters out are
+        never built.
+        The hashes are read one by one from the output of "git rev-list",
+        also in reverse order, so the commits are never all kept in memory.
+
+        :param str branch: branch to analyze (HEAD by default)
+        :param bool reverse_order: whether to return the commits from the
+            oldest to the newest
         :return: Generator[Commit], the generator of all the commits in the
             repo
         """
-        for commit in self.repo.iter_commits(branch, reverse=reverse_order):
+        for commit in self.repo.iter_commits(branch, reverse=reverse_order,
+                                             **kwargs):
             yield self.get_commit_from_gitpython(commit)
 
     def get_commit(self, commit_id: str) -> Commit:
@@ -124,9 +255,44 @@ class GitRepository:
         :param str commit_id: hash of the commit to analyze
         :return: Commit
         """
-        gp_commit = self.repo.commit(commit_id)
+        try:
+            sha, _, data = self._cat_file(commit_id + '^{commit}')
+        except ValueError:
+            # let GitPython raise the appropriate error
+            gp_commit = self.repo.commit(commit_id)
+        else:
+            gp_commit = GitCommit(self.repo, hex_to_bin(sha))
+            gp_commit._deserialize(BytesIO(data))  # pylint: disable=W0212
         return Commit(gp_commit, **self._commit_options)
 
+    def _get_full_hash(self, commit_id: str) -> str:
+        # SZZ resolves the same abbreviated hashes (from blame) over and over:
+        # keep a bounded LRU of abbreviated -> full hash. Only (abbreviated)
+        # hashes are cached, since references like HEAD can move.
+        with self._hash_cache_lock:
+            full_hash = self._hash_cache.get(commit_id)
+            if full_hash is not None:
+                self._hash_cache.move_to_end(commit_id)
+                return full_hash
+
+        try:
+            full_hash = self._cat_file(commit_id + '^{commit}')[0]
+        except ValueError:
+            # let GitPython raise the appropriate error
+            full_hash = self.repo.commit(commit_id).hexsha
+
+        if full_hash.startswith(commit_id):
+            with self._hash_cache_lock:
+                self._hash_cache[commit_id] = full_hash
+                if len(self._hash_cache) > HASH_CACHE_SIZE:
+                    self._hash_cache.popitem(last=False)
+        return full_hash
+
+    def _clear_caches(self) -> None:
+        # references (HEAD, branches, tags) can move after a checkout
+        self._tag_cache.clear()
+        self._tagged_commits = None
+
     def get_commit_from_gitpython(self, commit: GitCommit) -> Commit:
         """
         Build a PyDriller commit object from a GitPython commit object.
@@ -149,30 +315,46 @@ class GitRepository:
         with self.lock:
             self._delete_tmp_branch()
             self.git.checkout('-f', _hash, b='_PD')
+            self._on_pd_branch = True
+            self._clear_caches()
 
     def _delete_tmp_branch(self) -> None:
         try:
             # we are already in _PD, so checkout the master branch before
             # deleting it
-            if self.repo.active_branch.name == '_PD':
+            if self._is_on_pd_branch():
                 self.git.checkout('-f', self._commit_options["main_branch"])
+            self._on_pd_branch = False
             self.repo.delete_head('_PD', force=True)
         except GitCommandError:
             logger.debug("Branch _PD not found")
 
+    def _is_on_pd_branch(self) -> bool:
+        # ask git only the first time (e.g. a previous run left the repo in
+        # _PD), then trust what checkout and reset did
+        if self._on_pd_branch is None:
+            try:
+                self._on_pd_branch = self.repo.active_branch.name == '_PD'
+            except TypeError:
+                self._on_pd_branch = False
+        return self._on_pd_branch
+
     def files(self) -> List[str]:
         """
-        Obtain the list of the files (excluding .git directory).
+        Obtain the list of the files in the repository, as known by git:
+        tracked files and untracked files that are not ignored. Note that
+        tracked files deleted from the working tree are listed too.
 
         :return: List[str], the list of the files
         """
-        _all = []
-        for path, _, files in os.walk(str(self.path)):
-            if '.git' in path:
-                continue
-            for name in files:
-                _all.append(os.path.join(path, name))
-        return _all
+        # ask git for tracked and untracked (but not ignored) files instead
+        # of walking the whole working tree
+        files = self.git.ls_files('-z', '--cached', '--others',
+                                  '--exclude-standard')
+        names = [name for name in files.split('\0') if name]
+        if os.sep != '/':
+            names = [os.path.normpath(name) for name in names]
+        return [os.path.join(self._path_str, name) for name in names]
 
     def reset(self) -> None:
         """
@@ -183,15 +365,18 @@ class GitRepository:
         """
         with self.lock:
             self.git.checkout('-f', self._commit_options["main_branch"])
+            self._on_pd_branch = False
             self._delete_tmp_branch()
+            self._clear_caches()
 
-    def total_commits(self) -> int:
+    def total_commits(self, branch: str = None) -> int:
         """
         Calculate total number of commits.
 
+        :param str branch: branch to count the commits of (HEAD by default)
         :return: the total number of commits
         """
-        return len(list(self.get_list_commits()))
+        return int(self.git.rev_list('--count', branch or 'HEAD'))
 
     def get_commit_from_tag(self, tag: str) -> Commit:
         """
@@ -200,24 +385,27 @@ class GitRepository:
         :param str tag: the tag
         :return: Commit commit: the commit the tag referred to
         """
+        if tag in self._tag_cache:
+            return self.get_commit(self._tag_cache[tag])
+
         try:
             selected_tag = self.repo.tags[tag]
-            return self.get_commit(selected_tag.commit.hexsha)
+            self._tag_cache[tag] = selected_tag.commit.hexsha
+            return self.get_commit(self._tag_cache[tag])
         except (IndexError, AttributeError):
             logger.debug('Tag %s not found', tag)
             raise
 
-    def get_tagged_commits(self):
+    def get_tagged_commits(self) -> FrozenSet[str]:
         """
         Obtain the hash of all the tagged commits.
 
-        :return: list of tagged commits (can be empty if there are no tags)
+        :return: set of tagged commits (can be empty if there are no tags)
         """
-        tags = []
-        for tag in self.repo.tags:
-            if tag.commit:
-                tags.append(tag.commit.hexsha)
-        return tags
+        if self._tagged_commits is None:
+            self._tagged_commits = frozenset(
+                tag.commit.hexsha for tag in self.repo.tags if tag.commit)
+        return self._tagged_commits
 
     def parse_diff(self, diff: str) -> Dict[str, List[Tuple[int, str]]]:
         """
@@ -231,29 +419,29 @@ class GitRepository:
         :param str diff: diff of the commit
         :return: Dictionary
         """
-        lines = diff.split('\n')
         modified_lines = {'added': [], 'deleted': []}
+        added = modified_lines['added']
+        deleted = modified_lines['deleted']
 
         count_deletions = 0
         count_additions = 0
 
-        for line in lines:
-            line = line.rstrip()
+        for match in _DIFF_LINE_RE.finditer(diff):
+            tag, content = match.groups()
             count_deletions += 1
             count_additions += 1
 
-            if line.startswith('@@'):
-                count_deletions, count_additions = self._get_line_numbers(line)
-
-            if line.startswith('-'):
-                modified_lines['deleted'].append((count_deletions, line[1:]))
+            if tag == '-':
+                deleted.append((count_deletions, content.rstrip()))
                 count_additions -= 1
-
-            if line.startswith('+'):
-                modified_lines['added'].append((count_additions, line[1:]))
+            elif tag == '+':
+                added.append((count_additions, content.rstrip()))
                 count_deletions -= 1
-
-            if line == r'\ No newline at end of file':
+            elif tag == '@' and content.startswith('@'):
+                count_deletions, count_additions = self._get_line_numbers(
+                    match.group())
+            elif tag == '\\' and \
+                    content.rstrip() == ' No newline at end of file':
                 count_deletions -= 1
                 count_additions -= 1
 
@@ -261,13 +449,8 @@ class GitRepository:
 
     @staticmethod
     def _get_line_numbers(line):
-        token = line.split(" ")
-        numbers_old_file = token[1]
-        numbers_new_file = token[2]
-        delete_line_number = int(numbers_old_file.split(",")[0]
-                                 .replace("-", "")) - 1
-        additions_line_number = int(numbers_new_file.split(",")[0]) - 1
-        return delete_line_number, additions_line_number
+        match = _HUNK_HEADER_RE.match(line)
+        return int(match.group(1)) - 1, int(match.group(2)) - 1
 
     def get_commits_last_modified_lines(self, commit: Commit,
                                         modification: Modification = None,
@@ -305,11 +488,12 @@ class GitRepository:
                commits to ignore. (only works with git hyper blame)
         :return: the set containing all the bug inducing commits
         """
-        hashes_to_ignore = []
+        hashes_to_ignore = frozenset()
         if hashes_to_ignore_path is not None:
             assert os.path.exists(hashes_to_ignore_path), \
                 "The file with the commit hashes to ignore does not exist"
-            hashes_to_ignore = open(hashes_to_ignore_path).readlines()
+            hashes_to_ignore = self._get_hashes_to_ignore(
+                hashes_to_ignore_path)
 
         if modification is not None:
             modifications = [modification]
@@ -320,43 +504,79 @@ class GitRepository:
                                             hyper_blame,
                                             hashes_to_ignore)
 
+    def _get_hashes_to_ignore(self, path: str) -> FrozenSet[str]:
+        # read the file only once, unless it changes in the meanwhile
+        path = os.path.abspath(path)
+        key = (path, os.stat(path).st_mtime_ns)
+        if key not in self._hashes_to_ignore_cache:
+            with open(path) as hashes_file:
+                self._hashes_to_ignore_cache[key] = frozenset(
+                    line.strip() for line in hashes_file if line.strip())
+        return self._hashes_to_ignore_cache[key]
+
     def _calculate_last_commits(self, commit: Commit,
                                 modifications: List[Modification],
                                 hyper_blame: bool = False,
-                                hashes_to_ignore: List[str] = None) \
+                                hashes_to_ignore: FrozenSet[str] = None) \
             -> Dict[str, Set[str]]:
+        # Blaming a file at a fixed commit is read-only, so the blames of the
+        # different files run concurrently without taking self.lock: the
+        # pool never overlaps with the checkout/reset critical section.
+        if len(modifications) <= 1:
+            results = [self._blame_one(commit, mod, hyper_blame,
+                                       hashes_to_ignore)
+                       for mod in modifications]
+        else:
+            workers = min(MAX_BLAME_WORKERS, len(modifications))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(
+                    lambda mod: self._blame_one(commit, mod, hyper_blame,
+                                                hashes_to_ignore),
+                    modifications))
 
         commits = {}
+        for path, buggy_commits in results:
+            if buggy_commits:
+                commits.setdefault(path, set()).update(buggy_commits)
 
-        for mod in modifications:
+        return commits
+
+    def _blame_one(self, commit: Commit, mod: Modification,
+                   hyper_blame: bool = False,
+                   hashes_to_ignore: FrozenSet[str] = None) \
+            -> Tuple[str, Set[str]]:
+        path = mod.new_path
+        if mod.change_type == ModificationType.RENAME or \
+                mod.change_type == ModificationType.DELETE:
+            path = mod.old_path
+        deleted_lines = [num_line for num_line, line in
+                         self.parse_diff(mod.diff)['deleted']
+                         if not self._useless_line(line.strip())]
+
+        buggy_commits = set()
+        if not deleted_lines:
+            return path, buggy_commits
+
+        try:
+            blame = self._get_blame(commit.hash, path, hyper_blame,
+                                    hashes_to_ignore)
+            for num_line in deleted_lines:
+                buggy_commit = blame[num_line - 1].split(' ')[
+                    0].replace('^', '')
+                buggy_commits.add(self._get_full_hash(buggy_commit))
+        except GitCommandError:
+            logger.debug(
+                "Could not found file %s in commit %s. Probably a double "
+                "rename!", mod.filename, commit.hash)
+
+        if mod.change_type == ModificationType.RENAME:
             path = mod.new_path
-            if mod.change_type == ModificationType.RENAME or \
-                    mod.change_type == ModificationType.DELETE:
-                path = mod.old_path
-            deleted_lines = self.parse_diff(mod.diff)['deleted']
-            try:
-                blame = self._get_blame(commit.hash, path, hyper_blame,
-                                        hashes_to_ignore)
-                for num_line, line in deleted_lines:
-                    if not self._useless_line(line.strip()):
-                        buggy_commit = blame[num_line - 1].split(' ')[
-                            0].replace('^', '')
-
-                        if mod.change_type == ModificationType.RENAME:
-                            path = mod.new_path
-
-                        commits.setdefault(path, set()).add(
-                            self.get_commit(buggy_commit).hash)
-            except GitCommandError:
-                logger.debug(
-                    "Could not found file %s in commit %s. Probably a double "
-                    "rename!", mod.filename, commit.hash)
 
-        return commits
+        return path, buggy_commits
 
     def _get_blame(self, commit_hash: str, path: str,
                    hyper_blame: bool = False,
-                   hashes_to_ignore: List[str] = None):
+                   hashes_to_ignore: FrozenSet[str] = None):
         """
         If "git hyper-blame" is available, use it. Otherwise use normal blame.
         """
@@ -370,13 +590,7 @@ class GitRepository:
     def _useless_line(line: str):
         # this covers comments in Java and Python, as well as empty lines.
         # More have to be added!
-        return not line or \
-               line.startswith('//') or \
-               line.startswith('#') or \
-               line.startswith("/*") or \
-               line.startswith("'''") or \
-               line.startswith('"""') or \
-               line.startswith("*")
+        return not line or line.startswith(_USELESS_PREFIXES)
 
     def get_commits_modified_file(self, filepath: str) -> List[str]:
         """
@@ -386,7 +600,8 @@ class GitRepository:
         :param str filepath: path to the file
         :return: the list of commits' hash
         """
-        path = str(Path(filepath))
+        # git prints and expects "/", only Windows paths need normalizing
+        path = filepath if os.sep == '/' else str(Path(filepath))
 
         commits = []
         try:
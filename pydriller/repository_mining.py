@@ -18,18 +18,24 @@ This module includes 1 class, RepositoryMining, main class of PyDriller.
 
 import logging
 import os
+import shutil
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import List, Generator, Union
+from queue import Queue, Full
+from threading import Event
+from typing import Any, Dict, List, Generator, Union
 
 import pytz
-from git import Repo
+from git import Repo, GitCommandError
 
 from pydriller.domain.commit import Commit
 from pydriller.git_repository import GitRepository
 
 logger = logging.getLogger(__name__)
 
+QUEUE_SIZE = 64
+
 
 class RepositoryMining:
     """
@@ -50,7 +56,8 @@ class RepositoryMining:
                  only_commits: List[str] = None,
                  only_releases: bool = False,
                  filepath: str = None,
-                 histogram_diff: bool = False):
+                 histogram_diff: bool = False,
+                 n_workers: int = 1):
         """
         Init a repository mining. The only required parameter is
         "path_to_repo": to analyze a single repo, pass the absolute path to
@@ -84,7 +91,14 @@ class RepositoryMining:
         :param List[str] only_commits: only these commits will be analyzed
         :param str filepath: only commits that modified this file will be
             analyzed
+        :param int n_workers: number of repositories to analyze at the same
+            time (only if more than one repository is passed). If bigger
+            than 1, the commits of different repositories are interleaved
         """
+        # kept to create the RepositoryMining of every repository analyzed
+        # in parallel, see _traverse_repos_in_parallel
+        self._arguments = dict(locals())
+        del self._arguments['self']
 
         self._sanity_check_repos(path_to_repo)
         if isinstance(path_to_repo, str):
@@ -101,16 +115,26 @@ class RepositoryMining:
         self._to = to
         self._reversed_order = reversed_order
         self._only_in_branch = only_in_branch
+        # tuple and sets, since they are checked against every commit
         self._only_modifications_with_file_types = \
-            only_modifications_with_file_types
+            self._to_tuple(only_modifications_with_file_types)
         self._only_no_merge = only_no_merge
-        self._only_authors = only_authors
-        self._only_commits = only_commits
+        self._only_authors = self._to_set(only_authors)
+        self._only_commits = self._to_set(only_commits)
         self._only_releases = only_releases
         self._filepath = filepath
         self._filepath_commits = None
         self._tagged_commits = None
         self._histogram = histogram_diff
+        self._n_workers = n_workers
+
+    @staticmethod
+    def _to_tuple(values):
+        return tuple(values) if values is not None else None
+
+    @staticmethod
+    def _to_set(values):
+        return frozenset(values) if values is not None else None
 
     @staticmethod
     def _sanity_check_repos(path_to_repo):
@@ -168,6 +192,18 @@ class RepositoryMining:
         repo_folder = os.path.join(tmp_folder,
                                    self._get_repo_name_from_url(repo))
         logger.info("Cloning %s in temporary folder %s", repo, repo_folder)
+        if self._single is not None or self._only_commits is not None:
+            # only a few commits will be analyzed: do not download all the
+            # blobs, git fetches the ones we need when we need them
+            try:
+                Repo.clone_from(url=repo, to_path=repo_folder,
+                                filter='blob:none')
+                return repo_folder
+            except GitCommandError:
+                logger.info("Partial clone of %s failed, cloning the full "
+                            "repository", repo)
+                shutil.rmtree(repo_folder, ignore_errors=True)
+
         Repo.clone_from(url=repo, to_path=repo_folder)
 
         return repo_folder
@@ -177,82 +213,190 @@ class RepositoryMining:
         Analyze all the specified commits (all of them by default), returning
         a generator of commits.
         """
+        if self._n_workers > 1 and len(self._path_to_repo) > 1:
+            yield from self._traverse_repos_in_parallel()
+            return
+
         for path_repo in self._path_to_repo:
             # if it is a remote repo, clone it first in a temporary folder!
             if self._is_remote(path_repo):
                 tmp_folder = tempfile.TemporaryDirectory()
                 path_repo = self._clone_remote_repos(tmp_folder.name,
                                                      path_repo)
-            options = {}
-            if self._histogram:
-                options['histogram'] = True
-
-            git_repo = GitRepository(path_repo, **options)
-
-            self._sanity_check_filters(git_repo)
-            self._check_timezones()
-
-            logger.info('Analyzing git repository in %s', git_repo.path)
-
-            if self._filepath is not None:
-                self._filepath_commits = git_repo.get_commits_modified_file(
-                    self._filepath)
-
-            if self._only_releases:
-                self._tagged_commits = git_repo.get_tagged_commits()
-
-            for commit in git_repo.get_list_commits(self._only_in_branch,
-                                                    not self._reversed_order):
-                logger.info('Commit #%s in %s from %s', commit.hash,
-                            commit.committer_date,
-                            commit.author.name)
-
-                if self._is_commit_filtered(commit):
-                    logger.info('Commit #%s filtered', commit.hash)
+            git_repo = self._open_git_repository(path_repo)
+            try:
+                self._sanity_check_filters(git_repo)
+                self._check_timezones()
+
+                logger.info('Analyzing git repository in %s', git_repo.path)
+
+                if self._filepath is not None:
+                    self._filepath_commits = self._to_set(
+                        git_repo.get_commits_modified_file(self._filepath))
+
+                if self._only_releases:
+                    self._tagged_commits = git_repo.get_tagged_commits()
+
+                for commit in git_repo.get_list_commits(
+                        self._only_in_branch, not self._reversed_order,
+                        **self._rev_list_options()):
+                    logger.info('Commit #%s in %s from %s', commit.hash,
+                                commit.committer_date,
+                                commit.author.name)
+
+                    if self._is_commit_filtered(commit):
+                        logger.info('Commit #%s filtered', commit.hash)
+                        continue
+
+                    yield commit
+            finally:
+                # do not keep the git processes alive after the analysis
+                git_repo.close()
+
+    def _rev_list_options(self) -> Dict[str, Any]:
+        # Filters that "git rev-list" can apply by itself. They only narrow
+        # down the commits: _is_commit_filtered still checks all of them.
+        # "since" is not passed, since git stops the traversal at the first
+        # older commit and would lose commits with a skewed date.
+        options = {}  # type: Dict[str, Any]
+        if self._to is not None:
+            options['until'] = self._to.replace(microsecond=0).isoformat()
+        if self._only_no_merge:
+            options['no_merges'] = True
+        if self._only_authors is not None:
+            # git matches the pattern against "name <email>"
+            options['fixed_strings'] = True
+            options['author'] = [author + ' <'
+                                 for author in self._only_authors]
+        return options
+
+    def _open_git_repository(self, path_repo: str) -> GitRepository:
+        options = {}
+        if self._histogram:
+            options['histogram'] = True
+        return GitRepository(path_repo, **options)
+
+    def _traverse_repos_in_parallel(self) -> Generator[Commit, None, None]:
+        # Every repository is analyzed by its own RepositoryMining (the
+        # filters are resolved per repository) running in its own thread:
+        # most of the time is spent waiting for git, so threads are enough.
+        # The threads only return the hashes of the commits: the commits are
+        # built here, with a GitRepository used only by this thread, since
+        # the persistent git processes of GitPython are not thread-safe.
+        commits = Queue(maxsize=QUEUE_SIZE)
+        stop = Event()
+        paths = {}  # type: Dict[int, str]
+        # remote repositories are deleted only once all their commits have
+        # been returned, since the commits read them lazily
+        tmp_folders = {}  # type: Dict[int, tempfile.TemporaryDirectory]
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    commits.put(item, timeout=0.1)
+                    return True
+                except Full:
                     continue
-
-                yield commit
+            return False
+
+        def traverse(index, path_repo):
+            try:
+                if stop.is_set():
+                    # the analysis ended before this repository was reached
+                    return
+                if self._is_remote(path_repo):
+                    tmp_folders[index] = tempfile.TemporaryDirectory()
+                    path_repo = self._clone_remote_repos(
+                        tmp_folders[index].name, path_repo)
+                paths[index] = path_repo
+
+                arguments = dict(self._arguments, path_to_repo=path_repo,
+                                 n_workers=1)
+                for commit in RepositoryMining(**arguments).traverse_commits():
+                    if not put((index, commit.hash, None)):
+                        return
+            except Exception as e:  # pylint: disable=broad-except
+                put((index, None, e))
+            finally:
+                put((index, None, None))
+
+        git_repos = {}  # type: Dict[int, GitRepository]
+        try:
+            with ThreadPoolExecutor(max_workers=self._n_workers) as executor:
+                futures = [executor.submit(traverse, index, path_repo)
+                           for index, path_repo
+                           in enumerate(self._path_to_repo)]
+
+                try:
+                    running = len(self._path_to_repo)
+                    while running > 0:
+                        index, commit_hash, error = commits.get()
+                        if error is not None:
+                            raise error
+                        if commit_hash is None:
+                            # all the commits of this repository were read
+                            running -= 1
+                            if index in git_repos:
+                                git_repos.pop(index).close()
+                            if index in tmp_folders:
+                                tmp_folders.pop(index).cleanup()
+                            continue
+
+                        if index not in git_repos:
+                            git_repos[index] = self._open_git_repository(
+                                paths[index])
+                        yield git_repos[index].get_commit(commit_hash)
+                finally:
+                    stop.set()
+                    for future in futures:
+                        future.cancel()
+        finally:
+            # the threads are done, delete what is left
+            for git_repo in git_repos.values():
+                git_repo.close()
+            for tmp_folder in tmp_folders.values():
+                tmp_folder.cleanup()
 
     def _is_commit_filtered(self, commit: Commit):  # pylint: disable=R0911
+        # cheapest checks first: only the last one needs the modifications
         if self._single is not None and commit.hash != self._single:
             logger.debug(
                 'Commit filtered because is not the defined in single')
             return True
-        if (self._since is not None and commit.committer_date < self._since) \
-                or (self._to is not None and commit.committer_date > self._to):
-            return True
-        if self._only_modifications_with_file_types is not None:
-            if not self._has_modification_with_file_type(commit):
-                logger.debug('Commit filtered for modification types')
-                return True
-        if self._only_no_merge is True and commit.merge is True:
-            logger.debug('Commit filtered for no merge')
-            return True
-        if self._only_authors is not None and commit.author.name not in \
-                self._only_authors:
-            logger.debug("Commit filtered for author")
-            return True
         if self._only_commits is not None and commit.hash not in \
                 self._only_commits:
             logger.debug("Commit filtered because it is not one of the "
                          "specified commits")
             return True
+        if self._tagged_commits is not None and commit.hash not in \
+                self._tagged_commits:
+            logger.debug("Commit filtered because it is not tagged")
+            return True
         if self._filepath_commits is not None and commit.hash not in \
                 self._filepath_commits:
             logger.debug("Commit filtered because it did not modify the "
                          "specified file")
             return True
-        if self._tagged_commits is not None and commit.hash not in \
-                self._tagged_commits:
-            logger.debug("Commit filtered because it is not tagged")
+        if (self._since is not None and commit.committer_date < self._since) \
+                or (self._to is not None and commit.committer_date > self._to):
+            return True
+        if self._only_authors is not None and commit.author.name not in \
+                self._only_authors:
+            logger.debug("Commit filtered for author")
+            return True
+        if self._only_no_merge is True and commit.merge is True:
+            logger.debug('Commit filtered for no merge')
             return True
+        if self._only_modifications_with_file_types is not None:
+            if not self._has_modification_with_file_type(commit):
+                logger.debug('Commit filtered for modification types')
+                return True
 
         return False
 
     def _has_modification_with_file_type(self, commit):
         for mod in commit.modifications:
-            if mod.filename.endswith(
-                    tuple(self._only_modifications_with_file_types)):
+            if mod.filename.endswith(self._only_modifications_with_file_types):
                 return True
         return False
 
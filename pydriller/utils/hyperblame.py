@@ -12,6 +12,7 @@ for more information.
 import collections
 from datetime import datetime, timedelta, timezone
 import logging
+from threading import Lock
 
 from git import Git
 
@@ -19,6 +20,7 @@ logger = logging.getLogger(__name__)
 BlameLine = collections.namedtuple(
     'BlameLine',
     'commit context lineno_then lineno_now modified')
+BLAME_CACHE_SIZE = 256
 
 
 class HyperBlameCommit():
@@ -46,6 +48,8 @@ class GitHyperBlame:
     def __init__(self, path: str):
         self.g = Git(path)
         self.diff_hunks_cache = {}
+        self.blame_cache = collections.OrderedDict()
+        self._blame_cache_lock = Lock()
 
     def parse_blame(self, blameoutput):
         """Parses the output of git blame -p into a data structure."""
@@ -92,19 +96,25 @@ class GitHyperBlame:
         blame = self.g.blame('-p', revision, '--', filename)
         return list(self.parse_blame(blame))
 
-    def hyper_blame(self, ignored, filename, revision='HEAD'):
-        # Map from commit to parsed blame from that commit.
-        blame_from = {}
+    def _cache_blame_from(self, filename, commithash):
+        # The blame of a file at a given commit never changes, so the most
+        # recent ones are kept across calls: the same ignored commits are
+        # usually met again when blaming other files or commits.
+        key = (filename, commithash)
+        with self._blame_cache_lock:
+            if key in self.blame_cache:
+                self.blame_cache.move_to_end(key)
+                return self.blame_cache[key]
+
+        parsed = self.get_parsed_blame(filename, commithash)
+        with self._blame_cache_lock:
+            self.blame_cache[key] = parsed
+            if len(self.blame_cache) > BLAME_CACHE_SIZE:
+                self.blame_cache.popitem(last=False)
+        return parsed
 
-        def cache_blame_from(filename, commithash):
-            try:
-                return blame_from[commithash]
-            except KeyError:
-                parsed = self.get_parsed_blame(filename, commithash)
-                blame_from[commithash] = parsed
-                return parsed
-
-        parsed = cache_blame_from(filename, revision)
+    def hyper_blame(self, ignored, filename, revision='HEAD'):
+        parsed = self.get_parsed_blame(filename, revision)
 
         new_parsed = []
         for line in parsed:
@@ -117,8 +127,8 @@ class GitHyperBlame:
 
                 previouscommit, previousfilename = line.commit.previous.split(
                     ' ', 1)
-                parent_blame = cache_blame_from(previousfilename,
-                                                previouscommit)
+                parent_blame = self._cache_blame_from(previousfilename,
+                                                      previouscommit)
 
                 if len(parent_blame) == 0:
                     # The previous version of this file was empty,
@@ -17,8 +17,11 @@ import pytest
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
 
+from git import Repo
+
 from pydriller.domain.commit import ModificationType
 from pydriller.git_repository import GitRepository
+from pydriller.utils import hyperblame
 
 
 def test_projectname():
@@ -56,6 +59,16 @@ def test_list_commits():
     assert len(change_sets) == 5
 
 
+def test_list_commits_with_rev_list_options():
+    gr = GitRepository('test-repos/test1/')
+    change_sets = list(gr.get_list_commits(until='2018-03-22T10:42:03+01:00'))
+
+    assert [c.hash for c in change_sets] == [
+        'a88c84ddf42066611e76e6cb690144e5357d132c',
+        '6411e3096dd2070438a17b225f44475136e54e3a',
+        '09f6182cef737db02a085e1d018963c7a29bde5a']
+
+
 def test_get_commit():
     gr = GitRepository('test-repos/test1/')
     c = gr.get_commit('09f6182cef737db02a085e1d018963c7a29bde5a')
@@ -71,6 +84,84 @@ def test_get_commit():
     assert c.in_main_branch is True
 
 
+def test_get_commit_with_short_hash_and_missing():
+    gr = GitRepository('test-repos/test1/')
+    c = gr.get_commit('09f6182')
+    assert c.hash == '09f6182cef737db02a085e1d018963c7a29bde5a'
+    assert c.parents == ['6411e3096dd2070438a17b225f44475136e54e3a']
+
+    with pytest.raises(Exception):
+        gr.get_commit('not-a-commit')
+    gr.close()
+
+
+def test_full_hash_is_cached():
+    gr = GitRepository('test-repos/test1/')
+    assert gr._get_full_hash('09f6182') == \
+        '09f6182cef737db02a085e1d018963c7a29bde5a'
+    assert gr._hash_cache['09f6182'] == \
+        '09f6182cef737db02a085e1d018963c7a29bde5a'
+
+    # references are not cached, since they can move
+    assert gr._get_full_hash('HEAD') == \
+        'da39b1326dbc2edfe518b90672734a08f3c13458'
+    assert 'HEAD' not in gr._hash_cache
+
+    assert gr.get_commit_from_tag('v1.4').hash == \
+        '09f6182cef737db02a085e1d018963c7a29bde5a'
+    assert gr._tag_cache['v1.4'] == \
+        '09f6182cef737db02a085e1d018963c7a29bde5a'
+
+
+def test_git_repository_as_context_manager():
+    with GitRepository('test-repos/test1') as gr:
+        gr.get_commit('09f6182cef737db02a085e1d018963c7a29bde5a')
+        assert gr._cat_file_proc is not None
+    assert gr._cat_file_proc is None
+
+
+def test_cat_file():
+    gr = GitRepository('test-repos/test1/')
+    sha, obj_type, data = gr._cat_file(
+        '09f6182cef737db02a085e1d018963c7a29bde5a')
+    assert sha == '09f6182cef737db02a085e1d018963c7a29bde5a'
+    assert obj_type == 'commit'
+    assert data.endswith(b'Ooops file2\n')
+
+    # the same process is reused for the following reads
+    proc = gr._cat_file_proc
+    _, obj_type, _ = gr._cat_file(
+        '09f6182cef737db02a085e1d018963c7a29bde5a^{tree}')
+    assert obj_type == 'tree'
+    assert gr._cat_file_proc is proc
+
+    gr.close()
+    assert gr._cat_file_proc is None
+
+
+def test_cat_file_stays_in_sync():
+    gr = GitRepository('test-repos/test1/')
+    # a newline would be read by cat-file as two requests
+    assert gr.get_commit('09f6182cef737db02a085e1d018963c7a29bde5a\n').hash \
+        == '09f6182cef737db02a085e1d018963c7a29bde5a'
+    assert gr.get_commit('a88c84ddf42066611e76e6cb690144e5357d132c').hash \
+        == 'a88c84ddf42066611e76e6cb690144e5357d132c'
+    assert gr.get_commit('6411e3096dd2070438a17b225f44475136e54e3a').hash \
+        == '6411e3096dd2070438a17b225f44475136e54e3a'
+
+    # a dead process is replaced
+    proc = gr._cat_file_proc
+    proc.kill()
+    proc.wait()
+    assert gr.get_commit('6411e30').hash == \
+        '6411e3096dd2070438a17b225f44475136e54e3a'
+    assert gr._cat_file_proc is None
+    assert gr.get_commit('a88c84d').hash == \
+        'a88c84ddf42066611e76e6cb690144e5357d132c'
+    assert gr._cat_file_proc is not proc
+    gr.close()
+
+
 def test_get_first_commit():
     gr = GitRepository('test-repos/test1/')
     c = gr.get_commit('a88c84ddf42066611e76e6cb690144e5357d132c')
@@ -106,11 +197,31 @@ def test_files():
     assert str(Path('test-repos/test2/fold2/fold3/tmp8.py')) in all
 
 
+def test_files_skips_only_git_folder(tmp_path):
+    Repo.init(str(tmp_path))
+    (tmp_path / '.github').mkdir()
+    (tmp_path / '.github' / 'workflow.yml').write_text('on: push')
+    (tmp_path / '.gitignore').write_text('*.log')
+    (tmp_path / 'build.log').write_text('ignored')
+
+    gr = GitRepository(str(tmp_path))
+    all = gr.files()
+
+    assert len(all) == 2
+    assert str(tmp_path / '.github' / 'workflow.yml') in all
+    assert str(tmp_path / '.gitignore') in all
+
+
 def test_total_commits():
     gr = GitRepository('test-repos/test1/')
     assert gr.total_commits() == 5
 
 
+def test_total_commits_in_branch():
+    gr = GitRepository('test-repos/git-2/')
+    assert gr.total_commits('b1') == len(list(gr.get_list_commits('b1')))
+
+
 def test_get_commit_from_tag():
     gr = GitRepository('test-repos/test1/')
 
@@ -149,6 +260,18 @@ def test_checkout_consecutive_commits():
     gr.reset()
 
 
+def test_checkout_tracks_tmp_branch():
+    gr = GitRepository('test-repos/git-1/')
+    gr.checkout('a7053a4dcd627f5f4f213dc9aa002eb1caf926f8')
+    assert gr._on_pd_branch is True
+    assert gr.repo.active_branch.name == '_PD'
+    gr.checkout('9e71dd5726d775fb4a5f08506a539216e878adbb')
+    assert gr.repo.active_branch.name == '_PD'
+    gr.reset()
+    assert gr._on_pd_branch is False
+    assert '_PD' not in [b.name for b in gr.repo.branches]
+
+
 def test_checkout_with_commit_not_fully_merged_to_master():
     gr = GitRepository('test-repos/git-9/')
     gr.checkout('developing')
@@ -443,9 +566,10 @@ def test_get_tagged_commits():
     tagged_commits = gr.get_tagged_commits()
 
     assert len(tagged_commits) == 3
-    assert '6bb9e2c6a8080e6b5b34e6e316c894b2ddbf7fcd' == tagged_commits[0]
-    assert '4638730126d40716e230c2040751a13153fb1556' == tagged_commits[1]
-    assert '627e1ad917a188a861c9fedf6e5858b79edbe439' == tagged_commits[2]
+    assert '6bb9e2c6a8080e6b5b34e6e316c894b2ddbf7fcd' in tagged_commits
+    assert '4638730126d40716e230c2040751a13153fb1556' in tagged_commits
+    assert '627e1ad917a188a861c9fedf6e5858b79edbe439' in tagged_commits
+    assert gr.get_tagged_commits() is tagged_commits
 
 
 def test_get_tagged_commits_wo_tags():
@@ -482,6 +606,41 @@ def test_get_commits_last_modified_lines_hyper_blame_ignore_hash(tmp_path):
         'B.java']
 
 
+def test_hyper_blame_reuses_parent_blames(tmp_path, monkeypatch):
+    p = tmp_path / "ignore.txt"
+    p.write_text("540c7f31c18664a38190fafb6721b5174ff4a166")
+
+    gr = GitRepository('test-repos/test5/')
+    commit = gr.get_commit('e6d3b38a9ef683e8184eac10a0471075c2808bbd')
+
+    buggy_commits = gr.get_commits_last_modified_lines(
+        commit, hyper_blame=True, hashes_to_ignore_path=str(p))
+    cached_blames = len(gr.hyperblame.blame_cache)
+    assert cached_blames > 0
+
+    assert buggy_commits == gr.get_commits_last_modified_lines(
+        commit, hyper_blame=True, hashes_to_ignore_path=str(p))
+    assert len(gr.hyperblame.blame_cache) == cached_blames
+
+    # the cache is bounded
+    monkeypatch.setattr(hyperblame, 'BLAME_CACHE_SIZE', 0)
+    gr.hyperblame.blame_cache.clear()
+    assert buggy_commits == gr.get_commits_last_modified_lines(
+        commit, hyper_blame=True, hashes_to_ignore_path=str(p))
+    assert len(gr.hyperblame.blame_cache) == 0
+
+
+def test_get_hashes_to_ignore_is_cached(tmp_path):
+    p = tmp_path / "ignore.txt"
+    p.write_text("540c7f31c18664a38190fafb6721b5174ff4a166\n\n")
+
+    gr = GitRepository('test-repos/test5/')
+
+    hashes = gr._get_hashes_to_ignore(str(p))
+    assert hashes == {'540c7f31c18664a38190fafb6721b5174ff4a166'}
+    assert gr._get_hashes_to_ignore(str(p)) is hashes
+
+
 def test_get_commits_last_modified_lines_hyper_blame_with_renaming():
     gr = GitRepository('test-repos/test5/')
 
@@ -1,9 +1,12 @@
 import logging
+import time
 from datetime import datetime
+from pathlib import Path
 
 import pytest
+from git import Repo
 
-from pydriller import RepositoryMining
+from pydriller import RepositoryMining, GitRepository
 
 logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s',
                     level=logging.INFO)
@@ -79,3 +82,114 @@ def test_badly_formatted_url():
 
     with pytest.raises(Exception):
         list(RepositoryMining(path_to_repo='test').traverse_commits())
+
+
+def test_two_local_urls_in_parallel():
+    urls = ["test-repos/test1", "test-repos/test3"]
+    sequential = [c.hash for c in RepositoryMining(
+        path_to_repo=urls).traverse_commits()]
+    parallel = [c.hash for c in RepositoryMining(
+        path_to_repo=urls, n_workers=2).traverse_commits()]
+
+    assert len(parallel) == 11
+    assert sorted(parallel) == sorted(sequential)
+
+
+def test_parallel_stops_with_first_error():
+    urls = ["test-repos/test1", "test-repos/test3"]
+    with pytest.raises(Exception):
+        list(RepositoryMining(path_to_repo=urls, n_workers=2,
+                              from_commit='not-a-commit').traverse_commits())
+
+
+def test_git_repository_closed_after_bad_filter(monkeypatch):
+    opened = []
+
+    class RecordingGitRepository(GitRepository):
+        def __init__(self, path, **kwargs):
+            opened.append(self)
+            super().__init__(path, **kwargs)
+
+    monkeypatch.setattr('pydriller.repository_mining.GitRepository',
+                        RecordingGitRepository)
+
+    with pytest.raises(Exception):
+        list(RepositoryMining(path_to_repo='test-repos/test1',
+                              from_commit='not-a-commit').traverse_commits())
+
+    assert len(opened) == 1
+    assert opened[0]._cat_file_proc is None
+
+
+def test_parallel_can_be_interrupted(monkeypatch):
+    opened = []
+
+    class CountingGitRepository(GitRepository):
+        def __init__(self, path, **kwargs):
+            opened.append(path)
+            super().__init__(path, **kwargs)
+
+    monkeypatch.setattr('pydriller.repository_mining.GitRepository',
+                        CountingGitRepository)
+
+    urls = ["test-repos/git-1"] * 8
+    commits = RepositoryMining(path_to_repo=urls, n_workers=2)
+    for _ in commits.traverse_commits():
+        break
+
+    # the repositories still waiting for a worker are not analyzed
+    assert len(opened) < len(urls)
+
+
+def test_parallel_reads_source_code():
+    urls = ["test-repos/git-1", "test-repos/test5", "test-repos/git-9",
+            "test-repos/git-3"]
+
+    def source_codes(n_workers):
+        result = set()
+        for commit in RepositoryMining(
+                path_to_repo=urls, n_workers=n_workers).traverse_commits():
+            for mod in commit.modifications:
+                result.add((commit.hash, mod.filename, mod.source_code))
+        return result
+
+    assert source_codes(4) == source_codes(1)
+
+
+def test_clone_only_needed_objects_for_single_commit(tmp_path):
+    # the "server" has to allow partial clones
+    origin = Repo.clone_from(str(Path('test-repos/test1').resolve()),
+                             str(tmp_path / 'origin'))
+    origin.git.config('uploadpack.allowFilter', 'true')
+    url = (tmp_path / 'origin').resolve().as_uri()
+
+    mining = RepositoryMining(
+        path_to_repo=url,
+        single='09f6182cef737db02a085e1d018963c7a29bde5a')
+    clone_folder = tmp_path / 'clone'
+    clone_folder.mkdir()
+    repo_folder = mining._clone_remote_repos(str(clone_folder), url)
+
+    assert Repo(repo_folder).git.config(
+        'remote.origin.partialclonefilter') == 'blob:none'
+    commit = GitRepository(repo_folder).get_commit(
+        '09f6182cef737db02a085e1d018963c7a29bde5a')
+    assert len(commit.modifications) == 1
+
+
+def test_parallel_remote_repos_are_kept_until_read(monkeypatch):
+    monkeypatch.setattr(RepositoryMining, '_is_remote',
+                        staticmethod(lambda repo: repo.startswith('file:')))
+    urls = [Path('test-repos/test1').resolve().as_uri(),
+            Path('test-repos/test3').resolve().as_uri()]
+
+    branches = []
+    for commit in RepositoryMining(path_to_repo=urls,
+                                   n_workers=2).traverse_commits():
+        if not branches:
+            # let the workers finish their repositories
+            time.sleep(0.5)
+        branches.append(commit.branches)
+
+    assert len(branches) == 11
+    assert all(branches)